@@ -5,10 +5,17 @@
 # Was written for AoC2024
 #
 ########################################################################
-import copy
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from itertools import pairwise
+import mmap
+import os
+import re
 import sys
-from typing import Dict, List, Set, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 DEBUG1 = True
 DEBUG2 = False
@@ -27,8 +34,7 @@ class Coords:
         return f"<x{self.lind}y{self.pos}>"
 
     def __hash__(self) -> int:
-        """Assuming that all coordinates are > -10000"""
-        return (self.lind + 10000) * (self.pos + 10000)
+        return hash((self.lind, self.pos))
 
     def __add__(self, value, /):
         return Coords(self.lind + value.lind, self.pos + value.pos)
@@ -47,6 +53,11 @@ GUARDDIRS: Dict[str, Coords] = {
     "<": Coords(0, -1),
 }
 
+# Directions in clockwise order. In the packed guard state
+# cell * 4 + direction, direction is an index into this list, so
+# turning 90deg to the right is (direction + 1) % 4.
+DIRECTIONS: List[Coords] = [Coords(-1, 0), Coords(0, +1), Coords(+1, 0), Coords(0, -1)]
+
 # Turn 90deg to the right
 TURN90DEG: Dict[Coords, Coords] = {
     Coords(-1, 0): Coords(0, +1),
@@ -55,6 +66,167 @@ TURN90DEG: Dict[Coords, Coords] = {
     Coords(0, -1): Coords(-1, 0),
 }
 
+
+# Map cell contents
+OBSTACLE: int = ord("#")
+EMPTY: int = ord(".")
+
+########################################################################
+# Patterns
+########################################################################
+
+GUARD_PATTERN: re.Pattern = re.compile(rb"[\^>v<]")
+
+QUERY_PATTERN: re.Pattern = re.compile(r"^(?P<lind>\d+)\s*[,\s]\s*(?P<pos>\d+)$")
+
+
+class ObstacleIndex:
+    """
+    Sorted obstacle positions for every line and for every column of
+    the map. It lets the guard jump straight to the cell before the next
+    obstacle instead of walking the map one cell at a time.
+    The positions are kept in unsigned int arrays, 4 bytes each, rather
+    than in lists of Python ints.
+    """
+
+    def __init__(self, grid: "Grid"):
+        self.lines = grid.height
+        self.positions = grid.width
+        self.by_line: List[array] = [array("I") for _ in range(self.lines)]
+        self.by_pos: List[array] = [array("I") for _ in range(self.positions)]
+        # The map is scanned in order, so the lists come out sorted.
+        for lind in range(self.lines):
+            linestart = lind * grid.stride
+            lineend = linestart + grid.width
+            offset = grid.cells.find(b"#", linestart, lineend)
+            while offset >= 0:
+                self.by_line[lind].append(offset - linestart)
+                self.by_pos[offset - linestart].append(lind)
+                offset = grid.cells.find(b"#", offset + 1, lineend)
+
+    def add(self, obstacle: Coords) -> None:
+        insort(self.by_line[obstacle.lind], obstacle.pos)
+        insort(self.by_pos[obstacle.pos], obstacle.lind)
+
+    def discard(self, obstacle: Coords) -> None:
+        self.by_line[obstacle.lind].remove(obstacle.pos)
+        self.by_pos[obstacle.pos].remove(obstacle.lind)
+
+    def next_stop(self, cell: int, direction: int) -> Tuple[int, bool]:
+        """
+        Walk from cell (lind * positions + pos) in direction (an index
+        into DIRECTIONS) until hitting an obstacle or leaving the map.
+        Return the last cell inside the map and whether the guard was
+        stopped by an obstacle (False means that it left the map).
+        """
+        (lind, pos) = divmod(cell, self.positions)
+        if direction == 1:
+            obstacles = self.by_line[lind]
+            ind = bisect_right(obstacles, pos)
+            if ind < len(obstacles):
+                return (cell + obstacles[ind] - 1 - pos, True)
+            return (cell + self.positions - 1 - pos, False)
+        if direction == 3:
+            obstacles = self.by_line[lind]
+            ind = bisect_left(obstacles, pos)
+            if ind > 0:
+                return (cell - pos + obstacles[ind - 1] + 1, True)
+            return (cell - pos, False)
+        if direction == 2:
+            obstacles = self.by_pos[pos]
+            ind = bisect_right(obstacles, lind)
+            if ind < len(obstacles):
+                return ((obstacles[ind] - 1) * self.positions + pos, True)
+            return ((self.lines - 1) * self.positions + pos, False)
+        obstacles = self.by_pos[pos]
+        ind = bisect_left(obstacles, lind)
+        if ind > 0:
+            return ((obstacles[ind - 1] + 1) * self.positions + pos, True)
+        return (pos, False)
+
+
+class Grid:
+    """
+    The map as flat bytes, together with the index of its obstacles.
+    Line lind starts at offset lind * stride. The stride is the line
+    width for maps read from stdin, and includes the line terminator
+    for memory-mapped map files.
+    A blockage candidate is placed and removed in place by writing a
+    single byte (and updating the index), so the map is never copied.
+    A memory-mapped map is mapped copy-on-write, so the file itself is
+    never modified.
+    Cells, as used by traverse(), are numbered lind * width + pos
+    regardless of the stride.
+    length is the number of bytes holding map lines, excluding any
+    trailing empty lines of a map file. It defaults to len(cells).
+    turn_flags has a bit per packed guard state (cell * 4 + direction)
+    and is used by traverse() for loop detection. It is allocated by the
+    first traversal, and is all zeros between traversals.
+    """
+
+    def __init__(
+        self,
+        cells: Union[bytearray, mmap.mmap],
+        width: int,
+        stride: Optional[int] = None,
+        map_file: Optional[str] = None,
+        length: Optional[int] = None,
+    ):
+        self.cells = cells
+        self.width = width
+        self.stride = width if stride is None else stride
+        if length is None:
+            length = len(cells)
+        # The last line of a map file need not be terminated.
+        self.height = (length + self.stride - self.width) // self.stride
+        self.map_file = map_file  # Set for memory-mapped maps
+        self.obstacles = ObstacleIndex(self)
+        self.turn_flags: Optional[bytearray] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        A memory-mapped map is mapped again rather than pickled. The
+        obstacle index and turn_flags are rebuilt rather than pickled.
+        """
+        state = self.__dict__.copy()
+        if self.map_file is not None:
+            state["cells"] = None
+        del state["obstacles"]
+        del state["turn_flags"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        if self.map_file is not None:
+            self.cells = map_file_cells(self.map_file)
+        self.obstacles = ObstacleIndex(self)
+        self.turn_flags = None
+
+    def get_turn_flags(self) -> bytearray:
+        if self.turn_flags is None:
+            self.turn_flags = bytearray((self.width * self.height * 4 + 7) // 8)
+        return self.turn_flags
+
+    def offset(self, coords: Coords) -> int:
+        return coords.lind * self.stride + coords.pos
+
+    def cell(self, coords: Coords) -> int:
+        return coords.lind * self.width + coords.pos
+
+    def is_obstacle(self, coords: Coords) -> bool:
+        return self.cells[self.offset(coords)] == OBSTACLE
+
+    def place_obstacle(self, coords: Coords) -> None:
+        if self.is_obstacle(coords):
+            raise error("Obstacle already present", coords)
+        self.cells[self.offset(coords)] = OBSTACLE
+        self.obstacles.add(coords)
+
+    def remove_obstacle(self, coords: Coords) -> None:
+        self.cells[self.offset(coords)] = EMPTY
+        self.obstacles.discard(coords)
+
+
 ########################################################################
 # Classes for raising exceptions
 ########################################################################
@@ -69,64 +241,22 @@ class StopLoop(Exception):
 
 
 ########################################################################
-# Big functions
+# Map loading
 ########################################################################
 
 
-def traverse(
-    initial_map: List[str],
-    initial_guardpos: Coords,
-    initial_guarddir: Coords,
-) -> Tuple[str, Set[Coords]]:
-    guardpos = initial_guardpos
-    guarddir = initial_guarddir
-    MAP = copy.deepcopy(initial_map)
-
-    visited_pos: Set[Coords] = set()
-    visited_pos_dir: Set[Tuple[Coords, Coords]] = set()  # used to detect loops
-
-    while True:
-        if DEBUG2:
-            sys.stdout.write(
-                f"Iteration: guard is at {guardpos}, direction {guarddir}. Already visited {len(visited_pos)} positions excluding the current one.\n"
-            )
-        if (guardpos, guarddir) in visited_pos_dir:
-            # got into infinite loop
-            if DEBUG2:
-                sys.stdout.write("Ending due to infinite loop\n")
-            return ("INFINITE-LOOP", visited_pos)
-        visited_pos.add(guardpos)
-        visited_pos_dir.add((guardpos, guarddir))
-
-        nextpos = guardpos + guarddir
-        if (0 <= nextpos.lind and nextpos.lind < len(MAP)) and (
-            0 <= nextpos.pos and nextpos.pos < len(MAP[0])
-        ):
-            if MAP[nextpos.lind][nextpos.pos] == "#":
-                # Obstacle, turn to the right.
-                guarddir = TURN90DEG[guarddir]
-                if DEBUG2:
-                    sys.stdout.write(f"Obstacle at {nextpos}, turning to {guarddir}\n")
-            else:
-                guardpos = nextpos
-        else:
-            if DEBUG2:
-                sys.stdout.write("Ending due to leaving the map\n")
-            return ("LEFT-MAP", visited_pos)
-
-
-########################################################################
-if __name__ == "__main__":
-    ########################################################################
-    # Input data parsing
-    ########################################################################
-
-    MAP: List[str] = []
+def parse_map(lines: Iterable[str]) -> Tuple[Grid, Coords, Coords]:
+    """
+    Parse map lines, as read from stdin.
+    Return the map and the guard's initial position and direction.
+    """
+    cells = bytearray()
+    width = 0
     guardpos: Coords = Coords(-1, -1)
     guarddir: Coords = Coords(0, 0)
 
     lind = 0
-    for line in sys.stdin:
+    for line in lines:
         sline = line.strip()
         if len(sline) == 0:
             # Ignore empty lines, no special processing is needed.
@@ -150,68 +280,467 @@ if __name__ == "__main__":
                         f"Found the guard at {guardpos}, direction {guarddir}.\n"
                     )
 
-        MAP.append(sline)
+        if width == 0:
+            width = len(sline)
+        elif len(sline) != width:
+            raise error("Map lines differ in length", lind, width, len(sline))
+        cells.extend(sline.encode("ascii"))
         lind += 1
 
     if guarddir == Coords(0, 0):
         raise error("The guard was not found anywhere")
 
+    return (Grid(cells, width), guardpos, guarddir)
+
+
+def map_file_cells(map_file: str) -> mmap.mmap:
+    with open(map_file, "rb") as mapfd:
+        # Copy-on-write, so that blockage candidates stay private.
+        return mmap.mmap(mapfd.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+def load_map_file(map_file: str) -> Tuple[Grid, Coords, Coords]:
+    """
+    Memory-map a map file, whose lines must all have the same width.
+    The map is not copied into Python strings, and the guard is found
+    with a single scan of the mapping.
+    Return the map and the guard's initial position and direction.
+    """
+    # mmap cannot map an empty file.
+    if os.path.getsize(map_file) == 0:
+        raise error("Empty map file", map_file)
+    cells = map_file_cells(map_file)
+    width = cells.find(b"\n")
+    if width < 0:
+        width = len(cells)
+    stride = width + 1
+    if width > 0 and cells[width - 1] == ord("\r"):
+        width -= 1
+    if width == 0:
+        raise error("Empty map file", map_file)
+    # Ignore the terminator of the last line and any empty lines after
+    # it, as parse_map() does.
+    length = len(cells)
+    while length > 0 and cells[length - 1] in b"\r\n":
+        length -= 1
+    if (length % stride) != width:
+        raise error("Map file lines differ in length", map_file, width)
+    for lineend in range(stride - 1, length, stride):
+        if cells[lineend] != ord("\n"):
+            raise error(
+                "Map file lines differ in length", map_file, width, lineend // stride
+            )
+
+    guardpos: Coords = Coords(-1, -1)
+    guarddir: Coords = Coords(0, 0)
+    for mo in GUARD_PATTERN.finditer(cells, 0, length):
+        (lind, cind) = divmod(mo.start(), stride)
+        ch = mo.group().decode("ascii")
+        if guarddir != Coords(0, 0):
+            raise error(
+                "More than one guard found",
+                guardpos,
+                guarddir,
+                Coords(lind, cind),
+                GUARDDIRS[ch],
+            )
+        guardpos = Coords(lind, cind)
+        guarddir = GUARDDIRS[ch]
+        if DEBUG1:
+            sys.stdout.write(f"Found the guard at {guardpos}, direction {guarddir}.\n")
+    if guarddir == Coords(0, 0):
+        raise error("The guard was not found anywhere")
+
+    return (
+        Grid(cells, width, stride=stride, map_file=map_file, length=length),
+        guardpos,
+        guarddir,
+    )
+
+
+########################################################################
+# Big functions
+########################################################################
+
+
+def traverse(
+    grid: Grid,
+    initial_guardpos: Coords,
+    initial_guarddir: Coords,
+    visited: Optional[bytearray] = None,
+    path: Optional[List[Tuple[Coords, Coords]]] = None,
+) -> Tuple[str, int]:
+    """
+    Move the guard from obstacle to obstacle until it leaves the map or
+    gets into an infinite loop.
+    Return the status and the number of steps walked.
+    The map is not modified.
+    If visited is not None, it must have a byte per cell, and the cells
+    visited by the guard are set to 1.
+    If path is not None, the (position, direction) state at the start of
+    every segment, followed by the final state, is appended to it.
+    """
+    width = grid.width
+    next_stop = grid.obstacles.next_stop
+    turn_flags = grid.get_turn_flags()
+    turned: List[int] = []  # turn_flags bytes to clear when done
+    cell = grid.cell(initial_guardpos)
+    direction = DIRECTIONS.index(initial_guarddir)
+    steps = 0
+
+    try:
+        while True:
+            if DEBUG2:
+                sys.stdout.write(
+                    f"Iteration: guard is at {divmod(cell, width)}, direction {DIRECTIONS[direction]}. Walked {steps} steps so far.\n"
+                )
+            (stop, blocked) = next_stop(cell, direction)
+            if path is not None:
+                path.append((Coords(*divmod(cell, width)), DIRECTIONS[direction]))
+
+            # Record the whole segment walked by the guard.
+            stride = width if direction % 2 == 0 else 1
+            (first, last) = (cell, stop) if cell <= stop else (stop, cell)
+            segment = (last - first) // stride
+            steps += segment
+            if visited is not None:
+                visited[first : last + 1 : stride] = b"\x01" * (segment + 1)
+
+            if not blocked:
+                if DEBUG2:
+                    sys.stdout.write("Ending due to leaving the map\n")
+                if path is not None:
+                    path.append((Coords(*divmod(stop, width)), DIRECTIONS[direction]))
+                return ("LEFT-MAP", steps)
+
+            # A loop always revisits a turn, so only turns need to be recorded.
+            state = stop * 4 + direction
+            (flagind, flagbit) = (state >> 3, 1 << (state & 7))
+            if turn_flags[flagind] & flagbit:
+                # got into infinite loop
+                if DEBUG2:
+                    sys.stdout.write("Ending due to infinite loop\n")
+                if path is not None:
+                    path.append((Coords(*divmod(stop, width)), DIRECTIONS[direction]))
+                return ("INFINITE-LOOP", steps)
+            turn_flags[flagind] |= flagbit
+            turned.append(flagind)
+
+            # Obstacle, turn to the right.
+            cell = stop
+            direction = (direction + 1) % 4
+            if DEBUG2:
+                sys.stdout.write(
+                    f"Obstacle after {divmod(stop, width)}, turning to {DIRECTIONS[direction]}\n"
+                )
+    finally:
+        for flagind in turned:
+            turn_flags[flagind] = 0
+
+
+def first_visit_states(
+    path: List[Tuple[Coords, Coords]]
+) -> Dict[Coords, Tuple[Coords, Coords]]:
+    """
+    Map each position along path (as recorded by traverse()), except the
+    starting position, to the guard's state just before first entering it.
+    An obstacle placed at such a position does not change the walk up to
+    that state, so the guard can resume from there.
+    The dictionary is ordered by first visit.
+    """
+    startpos = path[0][0]
+    resume_states: Dict[Coords, Tuple[Coords, Coords]] = {}
+    for (segstart, segdir), (segend, _) in pairwise(path):
+        pos = segstart
+        while pos != segend:
+            nextpos = pos + segdir
+            if nextpos != startpos and nextpos not in resume_states:
+                resume_states[nextpos] = (pos, segdir)
+            pos = nextpos
+    return resume_states
+
+
+def path_blockage_candidates(
+    resume_states: Dict[Coords, Tuple[Coords, Coords]]
+) -> Iterator[Tuple[Coords, Coords, Coords]]:
+    """
+    Yield (candidate, resume position, resume direction) for every
+    position on the guard's original path except the starting position,
+    once each and in order of first visit.
+    An obstacle anywhere else is never reached, so it cannot change the
+    walk.
+    """
+    for candidate, (resume_pos, resume_dir) in resume_states.items():
+        yield (candidate, resume_pos, resume_dir)
+
+
+def neighbour_mask(grid: Grid, visited: bytearray) -> bytearray:
+    """
+    Return a bytearray, indexed by cell like visited, holding 1 for
+    every in-map neighbour of a visited cell.
+    Those are the blockage candidates of the exhaustive search.
+    """
+    width = grid.width
+    mask = bytearray(len(visited))
+    cell = visited.find(1)
+    while cell >= 0:
+        pos = cell % width
+        if pos > 0:
+            mask[cell - 1] = 1
+        if pos < width - 1:
+            mask[cell + 1] = 1
+        if cell >= width:
+            mask[cell - width] = 1
+        if cell + width < len(mask):
+            mask[cell + width] = 1
+        cell = visited.find(1, cell + 1)
+    return mask
+
+
+def try_blockage(
+    grid: Grid, candidate: Coords, resume_pos: Coords, resume_dir: Coords
+) -> Tuple[str, int]:
+    """
+    Place an obstacle at the candidate position, resume the guard's walk
+    from the given state and remove the obstacle again.
+    Return the traverse() status and number of steps walked since
+    resuming.
+    """
+    grid.place_obstacle(candidate)
+    try:
+        # The walk is unchanged until the guard first reaches the candidate.
+        return traverse(grid, resume_pos, resume_dir)
+    finally:
+        grid.remove_obstacle(candidate)
+
+
+########################################################################
+# Evaluation of blockage candidates, possibly in worker processes
+########################################################################
+
+# The map used by evaluate_candidate(). It is set once per process by
+# init_worker(), so that it is not shipped with every candidate.
+WORKER_GRID: Optional[Grid] = None
+
+
+def init_worker(grid: Grid) -> None:
+    global WORKER_GRID
+    WORKER_GRID = grid
+
+
+def evaluate_candidate(
+    candidate_state: Tuple[Coords, Coords, Coords]
+) -> Tuple[Coords, str, int]:
+    """
+    Evaluate a candidate yielded by path_blockage_candidates() using
+    try_blockage().
+    Return the candidate, traverse() status and number of steps walked
+    since resuming.
+    """
+    (candidate, resume_pos, resume_dir) = candidate_state
+    if WORKER_GRID is None:
+        raise error("init_worker() was not called")
+    (status, steps) = try_blockage(WORKER_GRID, candidate, resume_pos, resume_dir)
+    return (candidate, status, steps)
+
+
+########################################################################
+# What-if queries
+########################################################################
+
+
+class GuardMap:
+    """
+    A map parsed once, together with the guard's original walk and the
+    state from which to resume it for each position along the way.
+    It answers repeated "does an obstacle at this position create a
+    loop?" queries without parsing or walking the map again.
+
+    Usage:
+        guardmap = GuardMap.from_map_file("map.txt")
+        guardmap.creates_loop(Coords(6, 3))
+    """
+
+    def __init__(self, grid: Grid, guardpos: Coords, guarddir: Coords):
+        self.grid = grid
+        self.guardpos = guardpos
+        self.guarddir = guarddir
+        self.path: List[Tuple[Coords, Coords]] = []
+        self.visited = bytearray(grid.width * grid.height)
+        (self.status, _) = traverse(
+            grid, guardpos, guarddir, visited=self.visited, path=self.path
+        )
+        self.resume_states = first_visit_states(self.path)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]) -> "GuardMap":
+        return cls(*parse_map(lines))
+
+    @classmethod
+    def from_map_file(cls, map_file: str) -> "GuardMap":
+        return cls(*load_map_file(map_file))
+
+    def creates_loop(self, cell: Coords) -> bool:
+        """
+        Would placing an obstacle at cell get the guard into a loop?
+        No obstacle may be placed at the guard's initial position.
+        """
+        if not (0 <= cell.lind < self.grid.height and 0 <= cell.pos < self.grid.width):
+            raise error("Position outside the map", cell)
+        if cell == self.guardpos:
+            return False
+        resume_state = self.resume_states.get(cell)
+        if resume_state is None:
+            # The guard never gets there, so the walk does not change.
+            return self.status == "INFINITE-LOOP"
+        (status, _) = try_blockage(self.grid, cell, *resume_state)
+        return status == "INFINITE-LOOP"
+
+    def batch_creates_loop(self, cells: Iterable[Coords]) -> List[bool]:
+        return [self.creates_loop(cell) for cell in cells]
+
+
+def answer_queries(guardmap: GuardMap, lines: Iterable[str]) -> None:
+    """
+    Answer a stream of "lind,pos" queries, one per line, by writing
+    "lind,pos: LOOP" or "lind,pos: NO-LOOP" for each of them.
+    """
+    for line in lines:
+        sline = line.strip()
+        if len(sline) == 0:
+            continue
+        mo = QUERY_PATTERN.search(sline)
+        if mo is None:
+            raise error("bad query line", sline)
+        cell = Coords(int(mo.group("lind")), int(mo.group("pos")))
+        verdict = "LOOP" if guardmap.creates_loop(cell) else "NO-LOOP"
+        sys.stdout.write(f"{cell.lind},{cell.pos}: {verdict}\n")
+        sys.stdout.flush()
+
+
+########################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Solve the exercise of day 6 of AoC2024",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        dest="jobs",
+        help="Number of processes evaluating blockage candidates. Default is %(default)d.",
+    )
+    parser.add_argument(
+        "-m",
+        "--map-file",
+        default=None,
+        dest="map_file",
+        help="Memory-map the map from this fixed-width file instead of reading it from stdin.",
+    )
+    parser.add_argument(
+        "-q",
+        "--queries",
+        action="store_true",
+        dest="queries",
+        help="Read lind,pos obstacle positions from stdin, one per line, and tell for each whether it gets the guard into a loop. Requires --map-file.",
+    )
+    args = parser.parse_args()
+
+    MAP_FILE: Optional[str] = args.map_file
+    QUERIES: bool = args.queries
+    if QUERIES and MAP_FILE is None:
+        raise error("--queries requires --map-file, as stdin carries the queries")
+    if QUERIES:
+        DEBUG1 = False  # stdout carries only the answers.
+    JOBS: int = args.jobs
+    if JOBS < 1:
+        raise error("--jobs argument must be >= 1", JOBS)
+
+    ########################################################################
+    # Input data parsing
+    ########################################################################
+
+    if MAP_FILE is None:
+        (GRID, guardpos, guarddir) = parse_map(sys.stdin)
+    else:
+        (GRID, guardpos, guarddir) = load_map_file(MAP_FILE)
     if DEBUG1:
         sys.stdout.write(
-            f"Map has {len(MAP)} lines, line is {len(MAP[0])} positions long.\n"
+            f"Map has {GRID.height} lines, line is {GRID.width} positions long.\n"
         )
 
     ########################################################################
     # First part
     ########################################################################
-    (status, visited_pos) = traverse(MAP, guardpos, guarddir)
+    GUARDMAP = GuardMap(GRID, guardpos, guarddir)
+    if QUERIES:
+        answer_queries(GUARDMAP, sys.stdin)
+        sys.exit(0)
+
     if DEBUG1:
-        sys.stdout.write(f"Return value from traverse: {status}\n")
+        sys.stdout.write(f"Return value from traverse: {GUARDMAP.status}\n")
+    visited = GUARDMAP.visited
 
-    sys.stdout.write(f"\n\nFirst part answer: {len(visited_pos)}\n\n")
+    sys.stdout.write(f"\n\nFirst part answer: {visited.count(1)}\n\n")
 
     ########################################################################
     # Second part
     ########################################################################
     # 1. Compute candidate positions for getting the guard to loop.
 
-    blockage_candidates: Set[Coords] = set()
-    turn90deg = TURN90DEG.values()
-    for pos in visited_pos:
-        for delta in turn90deg:
-            next_candidate = pos + delta
-            if (0 <= next_candidate.lind and next_candidate.lind < len(MAP)) and (
-                0 <= next_candidate.pos and next_candidate.pos < len(MAP[0])
-            ):
-                blockage_candidates.add(next_candidate)
-    blockage_candidates.discard(guardpos)  # Do not obscure guard's initial position.
-    if DEBUG1:
+    blockage_candidates: List[Tuple[Coords, Coords, Coords]] = list(
+        path_blockage_candidates(GUARDMAP.resume_states)
+    )
+
+    # The neighbours of visited positions are needed only for measuring
+    # the pruning, and when the original walk is itself a loop. Then an
+    # obstacle which the guard never reaches leaves the guard looping.
+    neighbours: Optional[bytearray] = None
+    if DEBUG1 or GUARDMAP.status == "INFINITE-LOOP":
+        neighbours = neighbour_mask(GRID, visited)
+        neighbours[guardpos.lind * GRID.width + guardpos.pos] = 0
+    if DEBUG1 and neighbours is not None:
+        pruned = neighbours.count(1) - len(blockage_candidates)
         sys.stdout.write(
-            f"There are {len(blockage_candidates)} obstruction candidates at:\n"
+            f"There are {len(blockage_candidates)} obstruction candidates on the guard's path ({pruned} neighbouring positions pruned)\n"
         )
 
     ########################################################################
     # 2. Evaluate each blockage candidate.
     passed_candidates: Set[Coords] = set()
-
-    counter = 0
-    for candidate in blockage_candidates:
-        curmap = copy.deepcopy(MAP)
-        row_to_update = curmap[candidate.lind][:]
-        updated_row = (
-            row_to_update[: candidate.pos] + "#" + row_to_update[candidate.pos + 1 :]
+    if GUARDMAP.status == "INFINITE-LOOP" and neighbours is not None:
+        cell = neighbours.find(1)
+        while cell >= 0:
+            if not visited[cell]:
+                passed_candidates.add(Coords(*divmod(cell, GRID.width)))
+            cell = neighbours.find(1, cell + 1)
+
+    executor: Optional[ProcessPoolExecutor] = None
+    if JOBS > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=JOBS, initializer=init_worker, initargs=(GRID,)
         )
-        curmap[candidate.lind] = updated_row
-        (status, visited_pos) = traverse(curmap, guardpos, guarddir)
+        results = executor.map(
+            evaluate_candidate,
+            blockage_candidates,
+            chunksize=max(1, len(blockage_candidates) // (JOBS * 16)),
+        )
+    else:
+        init_worker(GRID)
+        results = map(evaluate_candidate, blockage_candidates)
+
+    for counter, (candidate, status, steps) in enumerate(results):
         if DEBUG1:
             if counter % 100 == 0:
                 sys.stdout.write(
-                    f"{counter}/{len(blockage_candidates)}: {candidate=}: {status=} positions={len(visited_pos)}\n"
+                    f"{counter}/{len(blockage_candidates)}: {candidate=}: {status=} {steps=}\n"
                 )
         if status == "INFINITE-LOOP":
             passed_candidates.add(candidate)
 
-        counter += 1
+    if executor is not None:
+        executor.shutdown()
 
     ########################################################################
     # Write out answer
@@ -5,13 +5,37 @@
 # Was written for AoC2024
 #
 ########################################################################
+import argparse
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
 import re
 import sys
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Only the numpy engine needs it.
 
 DEBUG1 = True
 DEBUG2 = False
 
+# Multiprocess streaming: lines are read CHUNK_LINES at a time, sorted by
+# decreasing number of arguments and dealt round-robin to tasks of about
+# TASK_LINES lines each.
+CHUNK_LINES = 4096
+TASK_LINES = 16
+
+# numpy engine: equations with up to NUMPY_MAX_ARGS arguments are
+# evaluated for all operator combinations at once, in batches of up to
+# NUMPY_MAX_ELEMENTS interim values.
+NUMPY_MAX_ARGS = 8
+NUMPY_MAX_ELEMENTS = 1 << 22
+
+# A parsed line: result, arguments and concat_powers(arguments)
+Equation = Tuple[int, List[int], List[int]]
+
 ########################################################################
 # Patterns
 ########################################################################
@@ -31,16 +55,28 @@ class error(Exception):
 ########################################################################
 
 
-def intconcat(val1: int, val2: int) -> int:
-    return int(str(val1) + str(val2))
+def concat_powers(args: List[int]) -> List[int]:
+    """For each argument, the power of ten by which intconcat() shifts
+    the value it is appended to.
+    Computed once per line.
+    """
+    return [10 ** len(str(arg)) for arg in args]
+
 
+def intconcat(val1: int, val2: int, power2: int) -> int:
+    """Decimal concatenation of val1 and val2, where power2 is
+    10 ** (number of digits of val2).
+    """
+    return val1 * power2 + val2
 
-def recurtree(target: int, interim: int, args: List[int]) -> bool:
+
+def recurtree(target: int, interim: int, args: List[int], powers: List[int]) -> bool:
     """Recursive tree traversal.
-    At each node we try both + and *
+    At each node we try +, * and ||
     Terminate with False if we overshoot the target value
         and/or reach exactly the value but did not empty the args.
-    Recurse by calling recurtree(target, interim OP val, args[1:])
+    powers is concat_powers(args).
+    Recurse by calling recurtree(target, interim OP val, args[1:], powers[1:])
     """
     if DEBUG2:
         sys.stdout.write(f"Entered recurtree with {target=} {interim=} {args=}\n")
@@ -49,23 +85,157 @@ def recurtree(target: int, interim: int, args: List[int]) -> bool:
     if interim > target:
         return False
 
-    if recurtree(target, interim + args[0], args[1:]):
+    if recurtree(target, interim + args[0], args[1:], powers[1:]):
         return True
-    elif recurtree(target, interim * args[0], args[1:]):
+    elif recurtree(target, interim * args[0], args[1:], powers[1:]):
         return True
     else:
-        return recurtree(target, intconcat(interim, args[0]), args[1:])
+        return recurtree(
+            target, intconcat(interim, args[0], powers[0]), args[1:], powers[1:]
+        )
 
 
-if __name__ == "__main__":
-    ########################################################################
-    # Input data parsing
-    ########################################################################
+def frontiertree(target: int, initial: int, args: List[int], powers: List[int]) -> bool:
+    """Iterative tree traversal, one argument at a time.
+    Keep the set of distinct interim values reachable after each argument,
+        so values reachable by several operator combinations are expanded
+        only once.
+    Values which overshoot the target are dropped as they are generated,
+        and we stop as soon as the target is reached with the last argument.
+    powers is concat_powers(args).
+    Gives the same answer as recurtree(target, initial, args, powers).
+    """
+    if len(args) == 0:
+        return initial == target
+    frontier: Set[int] = {initial} if initial <= target else set()
+    lastind = len(args) - 1
+    for ind, (arg, power) in enumerate(zip(args, powers)):
+        if DEBUG2:
+            sys.stdout.write(f"frontiertree {target=} {ind=} {len(frontier)=}\n")
+        nextfrontier: Set[int] = set()
+        for interim in frontier:
+            for value in (interim + arg, interim * arg, interim * power + arg):
+                if value <= target:
+                    if ind == lastind and value == target:
+                        return True
+                    nextfrontier.add(value)
+        if len(nextfrontier) == 0:
+            return False
+        frontier = nextfrontier
+    return False
 
-    cntgood = 0
-    sumgood = 0
 
-    for lind, line in enumerate(sys.stdin):
+def backtree(
+    target: int,
+    initial: int,
+    args: List[int],
+    powers: List[int],
+    nargs: Optional[int] = None,
+) -> bool:
+    """Reverse tree traversal, working backward from the target.
+    Only the first nargs args (default: all of them) are considered.
+    The last one is undone by each operator which could have produced
+    the target:
+        - subtract it, if the target is not smaller than it
+        - divide by it, only if the target is divisible by it
+        - strip its decimal digits, only if the target ends with them
+    powers is concat_powers(args).
+    Recurse by calling backtree(undone target, initial, args, powers,
+        nargs - 1) until only initial is left.
+    Most branches die immediately, unlike in recurtree().
+    Gives the same answer as recurtree(target, initial, args, powers).
+    With a zero argument, the interim value can drop back (x * 0 == 0),
+        and whether that is reachable depends upon recurtree()'s pruning
+        of overshooting interim values, so such lines are left to
+        recurtree().
+    """
+    if nargs is None:
+        if 0 in args:
+            return recurtree(target, initial, args, powers)
+        nargs = len(args)
+    if DEBUG2:
+        sys.stdout.write(f"Entered backtree with {target=} {initial=} {nargs=}\n")
+    if nargs == 0:
+        return target == initial
+    last = args[nargs - 1]
+    if target < last:
+        # No operator can yield a value smaller than its last operand.
+        return False
+
+    if backtree(target - last, initial, args, powers, nargs - 1):
+        return True
+    if target % last == 0:
+        if backtree(target // last, initial, args, powers, nargs - 1):
+            return True
+    power = powers[nargs - 1]
+    if (target - last) % power == 0:
+        return backtree((target - last) // power, initial, args, powers, nargs - 1)
+    return False
+
+
+def fits_int64(equation: Equation) -> bool:
+    """Can all interim values not exceeding the result, and all values
+    computed from them, be held in int64?
+    """
+    (result, arguments, powers) = equation
+    return result * max(max(arguments), max(powers)) + max(arguments) < 1 << 63
+
+
+def numpytree(equations: List[Equation]) -> List[bool]:
+    """Vectorized evaluation of equations having the same number of
+    arguments, starting from interim value 1 like recurtree().
+    After each argument there is a column for every operator combination
+        so far, so each argument triples the number of columns.
+    As in recurtree(), interim values which overshoot the result are
+        not expanded further. They are zeroed, so that they cannot
+        overflow, and masked out.
+    The equations must satisfy fits_int64().
+    Gives the same answers as recurtree().
+    """
+    targets = np.array([equation[0] for equation in equations], dtype=np.int64)
+    targets = targets[:, np.newaxis]
+    arguments = np.array([equation[1] for equation in equations], dtype=np.int64)
+    powers = np.array([equation[2] for equation in equations], dtype=np.int64)
+
+    interims = np.ones((len(equations), 1), dtype=np.int64)
+    alive = np.ones((len(equations), 1), dtype=bool)
+    for argind in range(arguments.shape[1]):
+        alive &= interims <= targets
+        interims = np.where(alive, interims, 0)
+        arg = arguments[:, argind : argind + 1]
+        power = powers[:, argind : argind + 1]
+        interims = np.concatenate(
+            (interims + arg, interims * arg, interims * power + arg), axis=1
+        )
+        alive = np.concatenate((alive, alive, alive), axis=1)
+    return [bool(flag) for flag in np.any(alive & (interims == targets), axis=1)]
+
+
+def numpy_flags(equations: Iterable[Equation]) -> Iterator[Tuple[Equation, bool]]:
+    """Solve equations by numpytree(), CHUNK_LINES at a time.
+    Within each chunk, equations are grouped by number of arguments.
+    Equations with too many arguments, or whose values could overflow
+        int64, are solved by recurtree() instead.
+    Yield each equation with its answer, not necessarily in input order.
+    """
+    equations = iter(equations)
+    while chunk := list(islice(equations, CHUNK_LINES)):
+        groups: Dict[int, List[Equation]] = defaultdict(list)
+        for equation in chunk:
+            (result, arguments, powers) = equation
+            if len(arguments) <= NUMPY_MAX_ARGS and fits_int64(equation):
+                groups[len(arguments)].append(equation)
+            else:
+                yield (equation, recurtree(result, 1, arguments, powers))
+        for nargs, group in groups.items():
+            batch = max(1, NUMPY_MAX_ELEMENTS // 3**nargs)
+            for start in range(0, len(group), batch):
+                batch_equations = group[start : start + batch]
+                yield from zip(batch_equations, numpytree(batch_equations))
+
+
+def parse_lines(lines: Iterable[str]) -> Iterator[Equation]:
+    for lind, line in enumerate(lines):
         sline = line.strip()
         if len(sline) == 0:
             # Ignore empty lines, no special processing is needed.
@@ -81,15 +251,133 @@ if __name__ == "__main__":
         if DEBUG1:
             sys.stdout.write(f"line {lind}: {result=} arguments={arguments}\n")
 
-        flag = recurtree(result, 1, arguments)
+        yield (result, arguments, concat_powers(arguments))
+
+
+def solve_equation(engine: str, equation: Equation) -> bool:
+    (result, arguments, powers) = equation
+    if engine == "backward":
+        return backtree(result, 1, arguments, powers)
+    elif engine == "frontier":
+        return frontiertree(result, 1, arguments, powers)
+    else:
+        return recurtree(result, 1, arguments, powers)
+
+
+def solve_equations(
+    engine: str, check: bool, equations: Iterable[Equation]
+) -> Tuple[int, int]:
+    """Solve equations using the given engine.
+    If check is True, cross-check each answer against recurtree().
+    Return the number of good equations and the sum of their results.
+    """
+    cntgood = 0
+    sumgood = 0
+    if engine == "numpy":
+        if np is None:
+            raise error("The numpy engine requires NumPy")
+        flags = numpy_flags(equations)
+    else:
+        flags = ((equation, solve_equation(engine, equation)) for equation in equations)
+    for (result, arguments, powers), flag in flags:
+        if check:
+            expected = recurtree(result, 1, arguments, powers)
+            if flag != expected:
+                raise error(
+                    "engine disagrees with recurtree()", engine, result, arguments, flag
+                )
         if flag:
             cntgood += 1
             sumgood += result
+    return (cntgood, sumgood)
+
+
+def solve_equations_parallel(
+    engine: str, check: bool, equations: Iterable[Equation], jobs: int
+) -> Tuple[int, int]:
+    """Like solve_equations(), using jobs worker processes.
+    Equations are streamed CHUNK_LINES at a time, and at most 2 * jobs
+    tasks are outstanding, so memory use does not grow with the input.
+    Within each chunk, equations are sorted by number of arguments and
+    dealt round-robin to the tasks, so that the expensive ones, which
+    dominate the run time, are spread over all workers.
+    """
+    cntgood = 0
+    sumgood = 0
+    pending: Set[Future] = set()
+    equations = iter(equations)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while chunk := list(islice(equations, CHUNK_LINES)):
+            chunk.sort(key=lambda equation: len(equation[1]), reverse=True)
+            # Deal the sorted equations round-robin, so that every task
+            # gets its share of the expensive ones.
+            ntasks = -(-len(chunk) // TASK_LINES)
+            for start in range(ntasks):
+                if len(pending) >= 2 * jobs:
+                    (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        (cnt, total) = future.result()
+                        cntgood += cnt
+                        sumgood += total
+                pending.add(
+                    executor.submit(
+                        solve_equations,
+                        engine,
+                        check,
+                        chunk[start::ntasks],
+                    )
+                )
+        for future in pending:
+            (cnt, total) = future.result()
+            cntgood += cnt
+            sumgood += total
+    return (cntgood, sumgood)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Solve the exercise of day 7 of AoC2024",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=["forward", "backward", "frontier", "numpy"],
+        default="forward",
+        dest="engine",
+        help="forward: recurtree() tries every operator from the first argument on. backward: backtree() works back from the result. frontier: frontiertree() keeps the distinct interim values after each argument. numpy: numpytree() evaluates all operator combinations of short equations as NumPy arrays (requires NumPy). Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        dest="check",
+        help="Cross-check the selected engine against recurtree() on every line.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        dest="jobs",
+        help="Number of processes solving equations. Default is %(default)d.",
+    )
+    args = parser.parse_args()
+
+    ENGINE: str = args.engine
+    CHECK: bool = args.check
+    JOBS: int = args.jobs
+    if JOBS < 1:
+        raise error("--jobs argument must be >= 1", JOBS)
 
     ########################################################################
-    # Main loop
+    # Input data parsing and main loop
     ########################################################################
 
+    equations = parse_lines(sys.stdin)
+    if JOBS > 1:
+        (cntgood, sumgood) = solve_equations_parallel(ENGINE, CHECK, equations, JOBS)
+    else:
+        (cntgood, sumgood) = solve_equations(ENGINE, CHECK, equations)
+
     sys.stdout.write(f"Found {cntgood} good equations\n")
 
     ########################################################################
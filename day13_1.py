@@ -5,15 +5,30 @@
 # Was written for AoC2024
 #
 ########################################################################
+import argparse
 from dataclasses import dataclass
-from itertools import chain
+from itertools import chain, islice
 import re
 import sys
 from typing import Optional
-from typing import List
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Only the numpy engine needs it.
 
 DEBUG1 = False
 
+# Added to the prize coordinates in part 2 of the puzzle
+PART2_OFFSET = 10_000_000_000_000
+
+# The numpy engine solves this many claw machines at a time.
+CHUNK_CLAWS = 65536
+
+# The bulk parser reads its input this many bytes at a time.
+BULK_READ_SIZE = 1 << 24
+
 ########################################################################
 # Data structures
 ########################################################################
@@ -32,18 +47,8 @@ class XY:
         return (self.x + 1) * (self.y + 1)
 
 
-@dataclass
-class Claw:
-    ba: XY
-    bb: XY
-    prize: XY
-
-    def __repr__(self) -> str:
-        return f"Claw(ba={self.ba}, bb={self.bb}, prize={self.prize})"
-
-    def __hash__(self) -> int:
-        """Assuming that all coordinates are nonnegative"""
-        return hash(self.ba + 1) * hash(self.bb + 1) * hash(self.prize + 1)
+# A claw machine: (ba.x, ba.y, bb.x, bb.y, prize.x, prize.y)
+Claw = Tuple[int, int, int, int, int, int]
 
 
 ########################################################################
@@ -56,6 +61,17 @@ BA_BB_PATTERN: re.Pattern = re.compile(
 
 PRIZE_PATTERN: re.Pattern = re.compile(r"^\s*Prize:\s+X=(?P<x>\d+),\s+Y=(?P<y>\d+)\s*$")
 
+# A whole claw machine definition in the usual layout. The six integers
+# are captured by their position within the 3-line block.
+CLAW_BLOCK_PATTERN: re.Pattern = re.compile(
+    rb"Button A: X\+(\d+), Y\+(\d+)[ \t\r]*\n[ \t]*"
+    rb"Button B: X\+(\d+), Y\+(\d+)[ \t\r]*\n[ \t]*"
+    rb"Prize: X=(\d+), Y=(\d+)"
+)
+
+# Whitespace between two claw machine definitions, including an empty line
+CLAW_SEPARATOR_PATTERN: re.Pattern = re.compile(rb"\s*\n[ \t\r]*\n\s*")
+
 
 ########################################################################
 # Classes for raising exceptions
@@ -71,17 +87,23 @@ class StopLoop(Exception):
 
 
 ########################################################################
-if __name__ == "__main__":
-    ########################################################################
-    # Input data parsing
-    ########################################################################
+# Parsing
+########################################################################
 
-    claws: List[Claw] = []
+
+def parse_claws(lines: Iterable[str], offset: int = 0) -> Iterator[Claw]:
+    """
+    Yield each claw machine as soon as the empty line (or end of input)
+    terminating it is read, with offset added to its prize coordinates.
+    Lines are parsed one at a time, so any layout accepted by
+    BA_BB_PATTERN and PRIZE_PATTERN, in any order, is supported.
+    """
     ba: Optional[XY] = None
     bb: Optional[XY] = None
     prize: Optional[XY] = None
+    count = 0
 
-    for line in chain(sys.stdin, ["\n"]):
+    for line in chain(lines, ["\n"]):
         sline = line.strip()
         if len(sline) == 0:
             if ba is None and bb is None and prize is None:
@@ -89,12 +111,8 @@ if __name__ == "__main__":
                 pass
             elif ba is not None and bb is not None and prize is not None:
                 # Finished defining a Claw machine
-                if len(sys.argv) > 1:
-                    # Adjust for part 2 of the puzzle.
-                    prize = XY(
-                        x=prize.x + 10_000_000_000_000, y=prize.y + 10_000_000_000_000
-                    )
-                claws.append(Claw(ba=ba, bb=bb, prize=prize))
+                yield (ba.x, ba.y, bb.x, bb.y, prize.x + offset, prize.y + offset)
+                count += 1
                 ba = None
                 bb = None
                 prize = None
@@ -129,63 +147,393 @@ if __name__ == "__main__":
                 raise error("Malformed line in claw definition", sline)
 
         if DEBUG1:
-            sys.stdout.write(
-                f"{sline=}:\n {ba=} {bb=} {prize=}    {len(claws)} so far\n"
+            sys.stdout.write(f"{sline=}:\n {ba=} {bb=} {prize=}    {count} so far\n")
+
+
+def empty_line_end(buffer: bytearray, start: int) -> int:
+    """
+    Return the position following the last empty (or whitespace only)
+    line in buffer, which ends at or after start. Return 0 if there is
+    no such line.
+    """
+    pos = buffer.rfind(b"\n")
+    while pos >= start:
+        prev = buffer.rfind(b"\n", 0, pos)
+        if prev < 0:
+            return 0
+        if len(buffer[prev + 1 : pos].strip()) == 0:
+            return pos + 1
+        pos = prev
+    return 0
+
+
+def parse_claws_bulk(stream: BinaryIO, offset: int = 0) -> Iterator[Claw]:
+    """
+    Like parse_claws(), reading stream BULK_READ_SIZE bytes at a time and
+    extracting whole claw machine definitions with CLAW_BLOCK_PATTERN.
+    Whenever the input departs from the usual layout, the rest of the
+    bytes read so far are handed over to parse_claws(), so that unusual
+    layouts are still accepted and malformed definitions are reported
+    the same way.
+    """
+    pending = bytearray()
+    while True:
+        data = stream.read(BULK_READ_SIZE)
+        at_eof = len(data) == 0
+        searched = len(pending)
+        pending += data
+        buffer = pending
+        if at_eof:
+            end = len(buffer)
+        else:
+            # Parse only up to the last empty line read so far.
+            end = empty_line_end(buffer, searched)
+            if end == 0:
+                continue
+        pending = buffer[end:]
+
+        # A claw machine is yielded only once the text following it is
+        # known to be well formed. Otherwise, parse_claws() takes over
+        # from the start of that claw machine.
+        (pos, resume, claw) = (0, 0, None)
+        for mo in CLAW_BLOCK_PATTERN.finditer(buffer, 0, end):
+            gap = buffer[pos : mo.start()]
+            if claw is None:
+                well_separated = len(gap.strip()) == 0
+            else:
+                well_separated = CLAW_SEPARATOR_PATTERN.fullmatch(gap) is not None
+            if not well_separated:
+                break
+            if claw is not None:
+                yield claw
+            (bax, bay, bbx, bby, prizex, prizey) = map(int, mo.groups())
+            claw = (bax, bay, bbx, bby, prizex + offset, prizey + offset)
+            (pos, resume) = (mo.end(), mo.start())
+        if len(buffer[pos:end].strip()) == 0:
+            if claw is not None:
+                yield claw
+        else:
+            # Non-ASCII bytes decode to U+FFFD, so that parse_claws()
+            # reports the malformed line.
+            yield from parse_claws(
+                buffer[resume:end].decode("utf-8", errors="replace").splitlines(),
+                offset,
             )
 
-    ########################################################################
-    # Main loop
-    ########################################################################
+        if at_eof:
+            return
 
-    tokens_total: int = 0
-    prizes_total: int = 0
-
-    for clawind, claw in enumerate(claws):
-        # The system of equations in unknowns A,B is:
-        #   prize.x = A*ba.x + B*bb.x
-        #   prize.y = A*ba.y + B*bb.y
-        # Eliminate B:
-        #   bb.y*prize.x = A*ba.x*bb.y + B*bb.x*bb.y
-        #   bb.x*prize.y = A*ba.y*bb.x + B*bb.x*bb.y
-        #   after subtraction: bb.y*prize.x - bb.x*prize.y = A(ba.x*bb.y - ba.y*bb.x)
-        # Condition for solution: ba.x*bb.y - ba.y*bb.x != 0 and also integer.
-        # A,B need also to be non-negative.
-        det = claw.ba.x * claw.bb.y - claw.ba.y * claw.bb.x
-        if det == 0:
-            sys.stdout.write(f"Claw {clawind} has no solution - zero determinant\n")
-            continue
-        A_numerator = claw.bb.y * claw.prize.x - claw.bb.x * claw.prize.y
-        if (A_numerator % det) != 0:
+
+########################################################################
+# Solvers
+########################################################################
+
+
+def extended_gcd(a: int, b: int) -> Tuple[int, int, int]:
+    """Return (g, x, y) such that a*x + b*y == g == gcd(a, b)."""
+    (old_r, r) = (a, b)
+    (old_x, x) = (1, 0)
+    (old_y, y) = (0, 1)
+    while r != 0:
+        quotient = old_r // r
+        (old_r, r) = (r, old_r - quotient * r)
+        (old_x, x) = (x, old_x - quotient * x)
+        (old_y, y) = (y, old_y - quotient * y)
+    return (old_r, old_x, old_y)
+
+
+def solve_collinear(claw: Claw) -> Optional[Tuple[int, int]]:
+    """
+    Solve a claw machine whose buttons move the claw along the same line
+    (zero determinant), in constant time.
+    Return the non-negative numbers of presses (A, B) costing the fewest
+    tokens, or None if the prize cannot be won.
+    """
+    (bax, bay, bbx, bby, prizex, prizey) = claw
+    if (bax, bay, bbx, bby) == (0, 0, 0, 0):
+        return (0, 0) if (prizex, prizey) == (0, 0) else None
+    # The prize must lie on the buttons' line.
+    if bax * prizey - bay * prizex != 0 or bbx * prizey - bby * prizex != 0:
+        return None
+    # Then it is enough to solve a*A + b*B = p along a coordinate in
+    # which the buttons move.
+    if (bax, bbx) != (0, 0):
+        (a, b, p) = (bax, bbx, prizex)
+    else:
+        (a, b, p) = (bay, bby, prizey)
+    if a == 0:
+        return (0, p // b) if p % b == 0 and p // b >= 0 else None
+    if b == 0:
+        return (p // a, 0) if p % a == 0 and p // a >= 0 else None
+
+    (g, x, y) = extended_gcd(a, b)
+    if p % g != 0:
+        return None
+    # All solutions are A = A0 + k*stepA, B = B0 - k*stepB.
+    (A0, B0) = (x * (p // g), y * (p // g))
+    (stepA, stepB) = (b // g, a // g)
+    kmin = -(A0 // stepA)  # Smallest k for which A >= 0
+    kmax = B0 // stepB  # Largest k for which B >= 0
+    if kmin > kmax:
+        return None
+    # Tokens = 3*A + B change by 3*stepA - stepB with each increment of k.
+    k = kmax if 3 * stepA - stepB < 0 else kmin
+    return (A0 + k * stepA, B0 - k * stepB)
+
+
+def solve_claw(
+    claw: Claw, clawind: int, verbose: bool = False
+) -> Optional[Tuple[int, int]]:
+    """
+    Return the numbers of presses (A, B) of buttons A and B which win
+    the prize, or None if there is none. If verbose, the reason is
+    written out.
+    """
+    # The system of equations in unknowns A,B is:
+    #   prizex = A*bax + B*bbx
+    #   prizey = A*bay + B*bby
+    # Eliminate B:
+    #   bby*prizex = A*bax*bby + B*bbx*bby
+    #   bbx*prizey = A*bay*bbx + B*bbx*bby
+    #   after subtraction: bby*prizex - bbx*prizey = A(bax*bby - bay*bbx)
+    # Likewise, eliminating A:
+    #   bax*prizey - bay*prizex = B(bax*bby - bay*bbx)
+    # Condition for solution: bax*bby - bay*bbx != 0 and also integer.
+    # A,B need also to be non-negative.
+    # If bax*bby - bay*bbx == 0, the buttons are collinear and
+    # solve_collinear() finds the cheapest solution, if any.
+    (bax, bay, bbx, bby, prizex, prizey) = claw
+    det = bax * bby - bay * bbx
+    if det == 0:
+        presses = solve_collinear(claw)
+        if presses is None and verbose:
+            sys.stdout.write(
+                f"Claw {clawind} has no solution - zero determinant, not collinear or no integer solution\n"
+            )
+        return presses
+    A_numerator = bby * prizex - bbx * prizey
+    if (A_numerator % det) != 0:
+        if verbose:
             sys.stdout.write(
                 f"Claw {clawind} has no integer solution {A_numerator} % {det} = {A_numerator % det}\n"
             )
-            continue
-        A = A_numerator // det
-        B_numerator = claw.prize.x - A * claw.ba.x
-        if (B_numerator % claw.bb.x) != 0:
+        return None
+    A = A_numerator // det
+    B_numerator = bax * prizey - bay * prizex
+    if (B_numerator % det) != 0:
+        if verbose:
             sys.stdout.write(
-                f"Claw {clawind} has no integer solution {B_numerator} % {claw.bb.x} = {B_numerator % claw.bb.x}\n"
+                f"Claw {clawind} has no integer solution {B_numerator} % {det} = {B_numerator % det}\n"
             )
+        return None
+    B = B_numerator // det
+
+    if (A < 0) or (B < 0):
+        raise error("Negative button presses.", A, B)
+    return (A, B)
+
+
+def solve_claw_offsets(
+    claw: Claw, offsets: List[int]
+) -> List[Optional[Tuple[int, int]]]:
+    """
+    Solve a claw machine once for each offset added to both prize
+    coordinates, as solve_claw() would, except that a solution needing
+    negative button presses means no prize (None) for that offset.
+    The determinant and the adjugate matrix are computed once. Adding
+    offset to the prize adds offset times the adjugate's row sums to the
+    numerators of Cramer's rule.
+    """
+    (bax, bay, bbx, bby, prizex, prizey) = claw
+    det = bax * bby - bay * bbx
+    if det == 0:
+        return [
+            solve_collinear((bax, bay, bbx, bby, prizex + offset, prizey + offset))
+            for offset in offsets
+        ]
+    # The adjugate is [[bby, -bbx], [-bay, bax]]
+    A_base = bby * prizex - bbx * prizey
+    B_base = bax * prizey - bay * prizex
+    A_slope = bby - bbx
+    B_slope = bax - bay
+
+    results: List[Optional[Tuple[int, int]]] = []
+    for offset in offsets:
+        A_numerator = A_base + offset * A_slope
+        B_numerator = B_base + offset * B_slope
+        if (A_numerator % det) != 0 or (B_numerator % det) != 0:
+            results.append(None)
             continue
-        B = B_numerator // claw.bb.x
-
+        (A, B) = (A_numerator // det, B_numerator // det)
         if (A < 0) or (B < 0):
-            raise error("Negative button presses.", A, B)
-
-        tokens = 3 * (A_numerator // det) + (B_numerator // claw.bb.x)
+            results.append(None)
+            continue
+        results.append((A, B))
+    return results
+
+
+def solve_claws_numpy(claws: List[Claw]) -> Tuple[int, int]:
+    """
+    Solve all claw machines at once by Cramer's rule on NumPy arrays.
+    Machines with collinear buttons (zero determinant) are solved by
+    solve_collinear(), one at a time.
+    Return the total number of tokens and the number of prizes won, the
+    same as from solve_claw() on each machine.
+    int64 is used when no product can overflow it. Otherwise (such as
+    when the coordinates are large), object arrays of Python ints are
+    used instead.
+    """
+    if len(claws) == 0:
+        return (0, 0)
+    max_button = max(max(claw[:4]) for claw in claws)
+    max_prize = max(max(claw[4:]) for claw in claws)
+    # All coordinates are nonnegative, so the largest magnitude of any
+    # product below is max_button * max(max_button, max_prize).
+    if 2 * max_button * max(max_button, max_prize) < 1 << 63:
+        dtype = np.int64
+    else:
+        dtype = object
+    (bax, bay, bbx, bby, prizex, prizey) = np.array(claws, dtype=dtype).T
+
+    det = bax * bby - bay * bbx
+    nonzero = det != 0
+    divisor = np.where(nonzero, det, 1)
+    A_numerator = bby * prizex - bbx * prizey
+    B_numerator = bax * prizey - bay * prizex
+    solvable = (
+        nonzero & (A_numerator % divisor == 0) & (B_numerator % divisor == 0)
+    ).astype(bool)
+    A = np.where(solvable, A_numerator // divisor, 0)
+    B = np.where(solvable, B_numerator // divisor, 0)
+
+    negative = np.flatnonzero((A < 0) | (B < 0))
+    if len(negative) > 0:
+        raise error("Negative button presses.", A[negative[0]], B[negative[0]])
+
+    # A and B fit in int64, but 3 * A + B may not; sum as Python ints.
+    tokens_total = 3 * sum(A.tolist()) + sum(B.tolist())
+    prizes_total = int(np.count_nonzero(solvable))
+
+    for clawind in np.flatnonzero(~nonzero).tolist():
+        presses = solve_collinear(claws[clawind])
+        if presses is not None:
+            tokens_total += 3 * presses[0] + presses[1]
+            prizes_total += 1
+    return (tokens_total, prizes_total)
+
+
+def solve_claws_numpy_stream(claws: Iterable[Claw]) -> Tuple[int, int]:
+    """
+    Like solve_claws_numpy(), holding only CHUNK_CLAWS claw machines at
+    a time.
+    """
+    tokens_total = 0
+    prizes_total = 0
+    claws = iter(claws)
+    while chunk := list(islice(claws, CHUNK_CLAWS)):
+        (tokens, prizes) = solve_claws_numpy(chunk)
         tokens_total += tokens
-        prizes_total += 1
-        if DEBUG1:
-            sys.stdout.write(
-                f"Claw {clawind}: {A=} {B=}  -->  {tokens=}   {tokens_total=} {prizes_total=}\n"
-            )
+        prizes_total += prizes
+    return (tokens_total, prizes_total)
+
+
+########################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Solve the exercise of day 13 of AoC2024",
+    )
+    parser.add_argument(
+        "part2",
+        nargs="?",
+        default=None,
+        help=f"Any value selects part 2 of the puzzle, which adds {PART2_OFFSET} to the prize coordinates.",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=["scalar", "numpy"],
+        default="scalar",
+        dest="engine",
+        help="scalar: solve one claw machine at a time. numpy: solve many of them at once as NumPy arrays (requires NumPy). Default is %(default)s.",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        dest="verbose",
+        help="Tell why each unsolvable claw machine has no solution (scalar engine).",
+    )
+    parser.add_argument(
+        "-o",
+        "--offsets",
+        default=None,
+        dest="offsets",
+        help="Comma separated prize offsets, such as 0,10_000_000_000_000. Report tokens and prizes for each of them, in one pass over the claw machines. Negative offsets are supported; a prize which would need negative button presses is not won.",
+    )
+    args = parser.parse_args()
+
+    PART2: bool = args.part2 is not None
+    ENGINE: str = args.engine
+    VERBOSE: bool = args.verbose
+    if ENGINE == "numpy" and np is None:
+        raise error("The numpy engine requires NumPy")
+    OFFSETS: Optional[List[int]] = None
+    if args.offsets is not None:
+        OFFSETS = [int(offset) for offset in args.offsets.split(",")]
+        if PART2:
+            raise error("--offsets cannot be combined with the part 2 argument")
+        if ENGINE == "numpy":
+            raise error("--offsets is not supported by the numpy engine")
+
+    ########################################################################
+    # Input data parsing
+    ########################################################################
+    # Claw machines are parsed and solved one at a time, so that only the
+    # running totals are kept.
+
+    claws = parse_claws_bulk(sys.stdin.buffer, PART2_OFFSET if PART2 else 0)
+
+    ########################################################################
+    # Main loop
+    ########################################################################
+
+    if OFFSETS is not None:
+        offset_tokens: List[int] = [0] * len(OFFSETS)
+        offset_prizes: List[int] = [0] * len(OFFSETS)
+        for claw in claws:
+            for offind, presses in enumerate(solve_claw_offsets(claw, OFFSETS)):
+                if presses is not None:
+                    offset_tokens[offind] += 3 * presses[0] + presses[1]
+                    offset_prizes[offind] += 1
+    elif ENGINE == "numpy":
+        (tokens_total, prizes_total) = solve_claws_numpy_stream(claws)
+    else:
+        tokens_total = 0
+        prizes_total = 0
+
+        for clawind, claw in enumerate(claws):
+            presses = solve_claw(claw, clawind, VERBOSE)
+            if presses is None:
+                continue
+            (A, B) = presses
+            tokens = 3 * A + B
+            tokens_total += tokens
+            prizes_total += 1
+            if DEBUG1:
+                sys.stdout.write(
+                    f"Claw {clawind}: {A=} {B=}  -->  {tokens=}   {tokens_total=} {prizes_total=}\n"
+                )
 
     ########################################################################
     # Write out answer
     ########################################################################
-    answer = tokens_total
+    if OFFSETS is not None:
+        for offset, tokens, prizes in zip(OFFSETS, offset_tokens, offset_prizes):
+            sys.stdout.write(f"Offset {offset}: {tokens} tokens, {prizes} prizes\n")
+    else:
+        answer = tokens_total
 
-    sys.stdout.write(f"\n\nANSWER ---> {answer=}\n")
+        sys.stdout.write(f"\n\nANSWER ---> {answer=}\n")
 
 else:
     pass
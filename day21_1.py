@@ -6,18 +6,25 @@
 #
 ########################################################################
 import argparse
+import hashlib
+import heapq
 from itertools import pairwise
+import json
+import os
 import sys
-from typing import Dict
+from typing import Any, Callable, Dict, Iterable
 from typing import List
-from typing import Optional, Tuple
+from typing import Optional, Set, Tuple, Union
 
-DEBUG1 = True
-DEBUG2 = True
-DEBUG3 = True
+DEBUG1 = False
+DEBUG2 = False
 DEBUG4 = False
 DEBUG5 = False
 
+# Keypad.movements holds, for each pair of keys, the path which is
+# cheapest when this many keypads separate the human from the keypad.
+MOVEMENTS_DEPTH = 25
+
 ########################################################################
 # Algorithm design
 ########################################################################
@@ -61,6 +68,9 @@ class Keypad:
     """
     Keypad definition consists of 3-Tuples of keynames and their
     coordinates.
+    The keypad is operated by a robot, which is directed by means of
+    the operator keypad (the keypad itself, if operator is None).
+    The movements are computed unless given (from the table cache).
     """
 
     MOVEMENTS: Dict[str, Tuple[int, int]] = {
@@ -70,6 +80,10 @@ class Keypad:
         "v": (0, 1),
     }
 
+    # costs[depth][keyfrom + keyto] is cost(keyfrom, keyto, depth), for
+    # the deepest level built so far only.
+    costs: Dict[int, Dict[str, int]]
+
     def validate_sequence_of_movements(
         self, x_from: int, y_from: int, movement: str
     ) -> bool:
@@ -92,127 +106,358 @@ class Keypad:
                 return False
         return True
 
-    def create_arrow_permutations(
-        self, x_from: int, y_from: int, x_to: int, y_to: int
-    ) -> List[str]:
-        if (x_from, y_from) not in self.legalpositions:
-            raise error("Illegal initial position", (x_from, y_from))
-        if (x_to, y_to) not in self.legalpositions:
-            raise error("Illegal target position", (x_to, y_to))
-        horiz = ">" if x_to > x_from else "<"
-        vert = "v" if y_to > y_from else "^"
-        genstr = horiz * abs(x_to - x_from) + vert * abs(y_to - y_from)
-        ## Now, permute genstr and filter it by means of validating function.
-        # return [
-        #    "".join(permuta)
-        #    for permuta in set(permutations(genstr))
-        #    if self.validate_sequence_of_movements(
-        #        x_from=x_from, y_from=y_from, movement=permuta
-        #    )
-        # ]
-        # ----------
-        # Consider only orderings which will yield shortest
-        # expansion for next robot in chain.
-        permutations = set(
-            [
-                horiz * abs(x_to - x_from) + vert * abs(y_to - y_from),
-                vert * abs(y_to - y_from) + horiz * abs(x_to - x_from),
-            ]
-        )
-        before_preferences = [
-            permuta
-            for permuta in permutations
-            if self.validate_sequence_of_movements(
-                x_from=x_from, y_from=y_from, movement=permuta
-            )
+    def is_movement(self, keyfrom: str, keyto: str, movement: str) -> bool:
+        """
+        Does movement (such as one from the table cache) move this keypad's
+        robot from keyfrom to keyto without passing over a gap, and then
+        press keyto?
+        """
+        if not movement.endswith("A") or any(
+            mov not in Keypad.MOVEMENTS for mov in movement[:-1]
+        ):
+            return False
+        (x_from, y_from) = self.keypositions[keyfrom]
+        if not self.validate_sequence_of_movements(
+            x_from=x_from, y_from=y_from, movement=movement[:-1]
+        ):
+            return False
+        x_to = x_from + sum(Keypad.MOVEMENTS[mov][0] for mov in movement[:-1])
+        y_to = y_from + sum(Keypad.MOVEMENTS[mov][1] for mov in movement[:-1])
+        return (x_to, y_to) == self.keypositions[keyto]
+
+    def cheapest_movement(
+        self, keyfrom: str, keyto: str, depth: int
+    ) -> Tuple[int, str]:
+        """
+        Find the movement (ending with "A") which moves this keypad's robot
+        from keyfrom to keyto and presses keyto, for the fewest human
+        keypresses when depth keypads separate the human from this keypad.
+        Paths of any shape, which do not pass over gaps, are considered.
+        The return value is (number of human keypresses, movement).
+        """
+        if depth == 0:
+            # The human presses keyto directly.
+            return (1, keyto)
+        position_to = self.keypositions[keyto]
+        operator_costs = self.operator.cost_table(depth - 1)
+        # Dijkstra's algorithm over states (position, last key pressed on
+        # the operator keypad). The operator's robot starts at "A".
+        # A state whose position is None means that keyto was pressed.
+        queue: List[Tuple[int, str, Optional[Tuple[int, int]], str]] = [
+            (0, "", self.keypositions[keyfrom], "A")
         ]
-        if len(before_preferences) == 1:
-            return before_preferences
-        # If both permutations are validated, then we reduce to
-        # one permutation using the following considration.
-        # There are three (horiz,vert) combinations in which we
-        # prefer one order over the other one.
-        if horiz == "<":
-            # In both "^<","v<", we prefer the "<" to come first.
-            return [horiz * abs(x_to - x_from) + vert * abs(y_to - y_from)]
+        done = set()
+        while len(queue) > 0:
+            (cost, movement, position, lastkey) = heapq.heappop(queue)
+            if position is None:
+                return (cost, movement)
+            if (position, lastkey) in done:
+                continue
+            done.add((position, lastkey))
+            if position == position_to:
+                heapq.heappush(
+                    queue,
+                    (
+                        cost + operator_costs[lastkey + "A"],
+                        movement + "A",
+                        None,
+                        "A",
+                    ),
+                )
+            for mov, (dx, dy) in Keypad.MOVEMENTS.items():
+                nextposition = (position[0] + dx, position[1] + dy)
+                if nextposition not in self.legalpositions:
+                    continue
+                heapq.heappush(
+                    queue,
+                    (
+                        cost + operator_costs[lastkey + mov],
+                        movement + mov,
+                        nextposition,
+                        mov,
+                    ),
+                )
+        raise error("Unreachable key", keyfrom, keyto)
+
+    def cost_table(self, depth: int) -> Dict[str, int]:
+        """
+        self.cost() for every pair of keys, keyed by keyfrom + keyto.
+        The tables are built bottom-up. Only the table of the deepest
+        level built so far is kept, so memory does not grow with depth.
+        """
+        if depth in self.costs:
+            return self.costs[depth]
+        if self.operator is self:
+            # Each level needs the level below it, from this keypad.
+            tabledepth = max((d for d in self.costs if d < depth), default=-1) + 1
         else:
-            # In ">v", we prefer the "v>" ordering.
-            # In ">^", both orderings are fine, and we choose "^>" to reduce testing.
-            return [vert * abs(y_to - y_from) + horiz * abs(x_to - x_from)]
+            tabledepth = depth
+        while tabledepth <= depth:
+            table: Dict[str, int] = {}
+            for keyfrom in self.keypositions:
+                for keyto in self.keypositions:
+                    (table[keyfrom + keyto], _) = self.cheapest_movement(
+                        keyfrom, keyto, tabledepth
+                    )
+            self.costs = {tabledepth: table}
+            tabledepth += 1
+        return self.costs[depth]
 
-    def __init__(self, definition: List[Tuple[str, int, int]]):
+    def cost(self, keyfrom: str, keyto: str, depth: int) -> int:
+        """
+        Number of human keypresses needed to move this keypad's robot from
+        keyfrom to keyto and press keyto, when depth keypads separate the
+        human from this keypad.
+        """
+        return self.cost_table(depth)[keyfrom + keyto]
+
+    def __init__(
+        self,
+        definition: List[Tuple[str, int, int]],
+        operator: Optional["Keypad"] = None,
+        movements: Optional[Dict[str, str]] = None,
+    ):
         self.legalpositions: Dict[Tuple[int, int], str] = {
             # A legal position is a position (int,int) having a key.
             (x_pos, y_pos): keyvalue
             for (keyvalue, x_pos, y_pos) in definition
         }
+        self.keypositions: Dict[str, Tuple[int, int]] = {
+            keyvalue: (x_pos, y_pos) for (keyvalue, x_pos, y_pos) in definition
+        }
+        self.operator: Keypad = self if operator is None else operator
+        self.costs = {}
         if DEBUG2:
             sys.stdout.write(f"Keypad instance created, {self.legalpositions=}\n")
+        if movements is not None:
+            self.movements: Dict[str, str] = movements
+            return
         # Generate the basic movements.
-        self.movements: Dict[
-            str, str
-        ] = {}  # Move from any char to any char on this keyboard.
+        # The cheapest path between two keys may depend upon the depth.
+        # Choose, for the engines which use a single movement table, the
+        # path which is cheapest at MOVEMENTS_DEPTH.
+        self.movements = {}  # Move from any char to any char on this keyboard.
         for keyfrom, x_from, y_from in definition:
             for keyto, x_to, y_to in definition:
                 if keyfrom == keyto:
                     continue
-                # We want to create all paths from keyfrom to keyto,
-                # excluding paths passing over gaps (i.e. having
-                # positions not in legalpositions).
-                movements: List[str] = [
-                    movement + "A"
-                    for movement in self.create_arrow_permutations(
-                        x_from=x_from, y_from=y_from, x_to=x_to, y_to=y_to
-                    )
-                ]
-                if len(movements) > 1:
-                    raise error(
-                        "More than one optimal path",
-                        keyfrom,
-                        x_from,
-                        y_from,
-                        keyto,
-                        x_to,
-                        y_to,
-                        movements,
-                    )
-                self.movements[keyfrom + keyto] = movements[0]
+                (_, movement) = self.cheapest_movement(keyfrom, keyto, MOVEMENTS_DEPTH)
+                if not self.validate_sequence_of_movements(
+                    x_from=x_from, y_from=y_from, movement=movement[:-1]
+                ):
+                    raise error("Movement passes over a gap", keyfrom, keyto, movement)
+                self.movements[keyfrom + keyto] = movement
         if DEBUG2:
             sys.stdout.write("Lengths of movements for this keypad\n")
             for movement in sorted(self.movements.keys()):
                 sys.stdout.write(f"movement {movement} -> {self.movements[movement]}\n")
 
 
-BOARD_NUMERIC_KEYPAD = Keypad(
-    definition=[
-        # x_from is from left to right
-        # y_from is from top to bottom
-        ("7", 0, 0),
-        ("8", 1, 0),
-        ("9", 2, 0),
-        ("4", 0, 1),
-        ("5", 1, 1),
-        ("6", 2, 1),
-        ("1", 0, 2),
-        ("2", 1, 2),
-        ("3", 2, 2),
-        #     0, 3 is forbidden
-        ("0", 1, 3),
-        ("A", 2, 3),
-    ]
-)
+DIRECTIONAL_KEYPAD_DEFINITION: List[Tuple[str, int, int]] = [
+    #     0, 0 is forbidden
+    ("^", 1, 0),
+    ("A", 2, 0),
+    ("<", 0, 1),
+    ("v", 1, 1),
+    (">", 2, 1),
+]
 
-BOARD_DIRECTIONAL_KEYPAD = Keypad(
-    definition=[
-        #     0, 0 is forbidden
-        ("^", 1, 0),
-        ("A", 2, 0),
-        ("<", 0, 1),
-        ("v", 1, 1),
-        (">", 2, 1),
-    ]
+NUMERIC_KEYPAD_DEFINITION: List[Tuple[str, int, int]] = [
+    # x_from is from left to right
+    # y_from is from top to bottom
+    ("7", 0, 0),
+    ("8", 1, 0),
+    ("9", 2, 0),
+    ("4", 0, 1),
+    ("5", 1, 1),
+    ("6", 2, 1),
+    ("1", 0, 2),
+    ("2", 1, 2),
+    ("3", 2, 2),
+    #     0, 3 is forbidden
+    ("0", 1, 3),
+    ("A", 2, 3),
+]
+
+########################################################################
+# Table cache
+#
+# Keypad movements and directional transition lengths are kept in a
+# JSON file between runs. Entries are keyed by a digest of the keypad
+# definitions (and the depth, for lengths). A file written with
+# another CACHE_VERSION is ignored.
+########################################################################
+
+CACHE_VERSION = 1
+
+# Lengths are cached only up to this depth. Deeper ones are big ints,
+# cheap to compute and not worth reading and writing on every run.
+CACHE_MAX_DEPTH = 64
+
+DEFAULT_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "aoc2024",
+    "day21_1.json",
 )
 
+
+class TableCache:
+    """
+    The cache file (if any) is read when the first entry is looked up,
+    and written by save() only if entries were added.
+    """
+
+    def __init__(self, filename: Optional[str] = None):
+        self.filename = filename
+        self.entries: Optional[Dict[str, Any]] = None
+        self.modified = False
+
+    def load(self) -> Dict[str, Any]:
+        if self.entries is None:
+            self.entries = {}
+            if self.filename is not None and os.path.exists(self.filename):
+                try:
+                    with open(self.filename) as cachefile:
+                        contents = json.load(cachefile)
+                except (OSError, ValueError):
+                    # An unreadable cache is rebuilt.
+                    contents = None
+                if (
+                    isinstance(contents, dict)
+                    and contents.get("version") == CACHE_VERSION
+                    and isinstance(contents.get("entries"), dict)
+                ):
+                    self.entries = contents["entries"]
+        return self.entries
+
+    def get(
+        self, key: str, valid: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[Any]:
+        """
+        An entry for which valid() is false is treated as missing, so
+        that it is rebuilt and replaced.
+        """
+        entry = self.load().get(key)
+        if entry is not None and valid is not None and not valid(entry):
+            return None
+        return entry
+
+    def put(self, key: str, value: Any) -> None:
+        self.load()[key] = value
+        self.modified = True
+
+    def save(self) -> None:
+        if self.filename is None or not self.modified:
+            return
+        # Write to a temporary file first, so that concurrent runs never
+        # see a partially written cache.
+        tmpname = f"{self.filename}.{os.getpid()}"
+        try:
+            os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+            with open(tmpname, "w") as cachefile:
+                json.dump(
+                    {"version": CACHE_VERSION, "entries": self.entries}, cachefile
+                )
+            os.replace(tmpname, self.filename)
+        except OSError:
+            # Failing to write the cache costs only time in the next run.
+            return
+        self.modified = False
+
+
+# The cache is kept in memory only, unless a file name is set.
+TABLE_CACHE = TableCache()
+
+
+def cache_key(kind: str, *details: Any) -> str:
+    definitions = json.dumps(
+        [
+            DIRECTIONAL_KEYPAD_DEFINITION,
+            NUMERIC_KEYPAD_DEFINITION,
+            MOVEMENTS_DEPTH,
+            details,
+        ]
+    )
+    return f"{kind}:{hashlib.sha256(definitions.encode()).hexdigest()}"
+
+
+def movement_keys(definition: List[Tuple[str, int, int]]) -> Set[str]:
+    """
+    The keys of Keypad.movements for a keypad definition: every pair of
+    distinct keys.
+    """
+    return {
+        keyfrom + keyto
+        for keyfrom, _, _ in definition
+        for keyto, _, _ in definition
+        if keyfrom != keyto
+    }
+
+
+def is_table(entry: Any, keys: Set[str], valuetype: type) -> bool:
+    """
+    Is a cache entry a dict from exactly keys to values of valuetype?
+    """
+    return (
+        isinstance(entry, dict)
+        and entry.keys() == keys
+        and all(
+            type(value) is valuetype  # Rejects bool for int, too.
+            for value in entry.values()
+        )
+    )
+
+
+########################################################################
+# Keypads
+#
+# The keypads are built on first use, reusing cached movements.
+########################################################################
+
+KEYPADS: Dict[str, Keypad] = {}
+
+
+def build_keypad(
+    name: str,
+    definition: List[Tuple[str, int, int]],
+    operator: Optional[Keypad] = None,
+) -> Keypad:
+    key = cache_key("movements", name)
+    keys = movement_keys(definition)
+    # A keypad without movements is enough to check the cached ones.
+    keypad = Keypad(definition=definition, operator=operator, movements={})
+    movements: Optional[Dict[str, str]] = TABLE_CACHE.get(
+        key,
+        lambda entry: is_table(entry, keys, str)
+        and all(
+            keypad.is_movement(pair[0], pair[1], movement)
+            for pair, movement in entry.items()
+        ),
+    )
+    if movements is None:
+        keypad = Keypad(definition=definition, operator=operator)
+        TABLE_CACHE.put(key, keypad.movements)
+    else:
+        keypad.movements = movements
+    return keypad
+
+
+def directional_keypad() -> Keypad:
+    if "directional" not in KEYPADS:
+        KEYPADS["directional"] = build_keypad(
+            "directional", DIRECTIONAL_KEYPAD_DEFINITION
+        )
+    return KEYPADS["directional"]
+
+
+def numeric_keypad() -> Keypad:
+    if "numeric" not in KEYPADS:
+        KEYPADS["numeric"] = build_keypad(
+            "numeric", NUMERIC_KEYPAD_DEFINITION, operator=directional_keypad()
+        )
+    return KEYPADS["numeric"]
+
+
 ########################################################################
 # Shortdata input
 ########################################################################
@@ -249,92 +494,335 @@ class StopLoop(Exception):
 ########################################################################
 
 
-def expand_line_by_keypad(keypad: Keypad, line: str) -> str:
+# A tracer is called with each transition (from, to) of the line being
+# expanded, and the movement (or length) which it expands into.
+Tracer = Callable[[str, str, Union[str, int]], None]
+
+
+def make_tracer(code: str, level: int) -> Tracer:
+    def trace(pos_from: str, pos_to: str, expansion: Union[str, int]) -> None:
+        sys.stdout.write(
+            f"trace {code} level {level}: {pos_from}{pos_to} -> {expansion}\n"
+        )
+
+    return trace
+
+
+def select_tracer(
+    codes: Set[str], levels: Optional[Set[int]], code: str, level: int
+) -> Optional[Tracer]:
+    """
+    A tracer for code at level, if code is among codes and level among
+    levels (None meaning all levels).
+    """
+    if code in codes and (levels is None or level in levels):
+        return make_tracer(code, level)
+    return None
+
+
+def expand_line_by_keypad(
+    keypad: Keypad, line: str, trace: Optional[Tracer] = None
+) -> str:
+    movements = keypad.movements
     aline = "A" + line  # All robots start at position "A".
-    retval: str = ""
+    if trace is None:
+        return "".join(
+            [
+                "A" if pos_from == pos_to else movements[pos_from + pos_to]
+                for pos_from, pos_to in pairwise(aline)
+            ]
+        )
+    parts: List[str] = []
     for pos_from, pos_to in pairwise(aline):
-        if pos_from == pos_to:
-            retval += "A"
-        else:
-            retval += keypad.movements[pos_from + pos_to]
-        if DEBUG3:
-            if line in ["029A", "379A"]:
-                sys.stdout.write(f"{line=} debug: {pos_from=},{pos_to=} -> {retval=}\n")
-    return retval
+        parts.append("A" if pos_from == pos_to else movements[pos_from + pos_to])
+        trace(pos_from, pos_to, parts[-1])
+    return "".join(parts)
 
 
 ########################################################################
 # Plan for handling very long sequences.
 #
-# For each movement in BOARD_DIRECTIONAL_KEYPAD, expand it 10 times.
+# For each movement in the directional keypad, find the length of its
+# expansion through 10 levels.
 # Then for input line which needs to be expanded only 10 more times,
-# expand it using the 10-times-expanded stuff and accumulate only
+# expand it using the 10-times-expanded lengths and accumulate only
 # lengths rather than full strings.
+#
+# The lengths are found without expanding any strings: the length of a
+# movement through n+1 levels is the sum of the lengths through n levels
+# of the transitions made when typing the movement (see
+# prepare_transition_expansions() below).
 
 
 def prepare_10x_expansion_dict(
-    factor: int, keypad: Keypad = BOARD_DIRECTIONAL_KEYPAD  # TENx_EXPANSION_FACTOR
+    factor: int, keypad: Optional[Keypad] = None  # TENx_EXPANSION_FACTOR
 ) -> Dict[str, int]:
     """
     The return value is Dict from str defining movement to
     length of 10x (or TENx_EXPANSION_FACTOR value) expanded string.
+    keypad defaults to the directional keypad.
     """
+    if keypad is None:
+        keypad = directional_keypad()
+    expansions = prepare_transition_expansions(keypad)
+    # Length of the expansion of each transition through 1 level
+    lengths: Dict[str, int] = {
+        transition: sum(subtransitions.values())
+        for transition, subtransitions in expansions.items()
+    }
+    for loopind in range(1, factor):
+        lengths = {
+            transition: sum(
+                count * lengths[subtransition]
+                for subtransition, count in subtransitions.items()
+            )
+            for transition, subtransitions in expansions.items()
+        }
+
     retval: Dict[str, int] = {}
     for movement in keypad.movements.keys():
-        move: str = movement
-        if DEBUG1:
-            sys.stdout.write(f"Starting move: {move}\n")
-        # When starting the move:
-        # In 1st iteration, we want to expand only the 2nd ("to")
-        # character.
-        # The 1st ("from") character merely tells us from where we
-        # are coming.
-        # In subsequent iterations, 1st character is always the "A"
-        # of the previous expanded movement.
-        move_expanded = keypad.movements[move]
-        move = move_expanded
-        if DEBUG1:
-            sys.stdout.write(f"Expansion 0: {move[:50]} ({len(move)} chars long)\n")
-        for loopind in range(1, factor):
-            move_expanded = expand_line_by_keypad(keypad=keypad, line=move)
-            move = move_expanded
-            if DEBUG1:
-                sys.stdout.write(
-                    f"Expansion {loopind}: {move[:50]} ({len(move)} chars long)\n"
-                )
-
-        retval[movement] = len(move)
+        retval[movement] = lengths[movement]
         if DEBUG1:
             sys.stdout.write(
-                f"prepare_10x_expansion_dict: {movement=} -> length={len(move)}\n"
+                f"prepare_10x_expansion_dict: {movement=} -> length={lengths[movement]}\n"
             )
     return retval
 
 
+def directional_lengths(depth: int) -> Dict[str, int]:
+    """
+    prepare_10x_expansion_dict() for the directional keypad, through
+    the table cache up to CACHE_MAX_DEPTH.
+    """
+    if depth > CACHE_MAX_DEPTH:
+        return prepare_10x_expansion_dict(factor=depth, keypad=directional_keypad())
+    key = cache_key("lengths", depth)
+    keys = movement_keys(DIRECTIONAL_KEYPAD_DEFINITION)
+    lengths: Optional[Dict[str, int]] = TABLE_CACHE.get(
+        key, lambda entry: is_table(entry, keys, int)
+    )
+    if lengths is None:
+        lengths = prepare_10x_expansion_dict(factor=depth, keypad=directional_keypad())
+        TABLE_CACHE.put(key, lengths)
+    return lengths
+
+
 ########################################################################
 
 
-def execute_10x_expansion(movelengths: Dict[str, int], line: str) -> int:
+def execute_10x_expansion(
+    movelengths: Dict[str, int], line: str, trace: Optional[Tracer] = None
+) -> int:
     """
     This function saves time and space by accumulating only
     lengths, rather than the full movement strings.
     """
     aline = "A" + line
+    if trace is None:
+        return sum(
+            1 if pos_from == pos_to else movelengths[pos_from + pos_to]
+            for pos_from, pos_to in pairwise(aline)
+        )
     retval: int = 0
     for pos_from, pos_to in pairwise(aline):
-        if pos_from == pos_to:
-            retval += 1  # corresponds to "A"
-            if DEBUG5:
-                sys.stdout.write(f"""***** add 1 for "A", yielding {retval=} *****\n""")
-        else:
-            retval += movelengths[pos_from + pos_to]
-            if DEBUG5:
-                sys.stdout.write(
-                    f"""***** "{pos_from + pos_to}": add {movelengths[pos_from + pos_to]} yielding {retval=} *****\n"""
+        # Pressing "A" again corresponds to "A" at every level.
+        length = 1 if pos_from == pos_to else movelengths[pos_from + pos_to]
+        trace(pos_from, pos_to, length)
+        retval += length
+    return retval
+
+
+########################################################################
+# Pair-count expansion
+#
+# Every robot starts at "A" and returns to it after each keypress it
+# causes, so the length of the next expansion of a string depends only
+# upon how many times each (from,to) transition occurs in "A" + string.
+# Since every movement ends with "A", the transitions of the expanded
+# string are the transitions of "A" + movement, summed over the
+# transitions of the string being expanded. Each level then costs the
+# same, however long the strings grow.
+
+
+def line_transitions(line: str) -> Dict[str, int]:
+    """
+    Count the transitions made when typing line, keyed by from+to
+    (as in Keypad.movements).
+    """
+    retval: Dict[str, int] = {}
+    for pos_from, pos_to in pairwise("A" + line):
+        retval[pos_from + pos_to] = retval.get(pos_from + pos_to, 0) + 1
+    return retval
+
+
+def prepare_transition_expansions(keypad: Keypad) -> Dict[str, Dict[str, int]]:
+    """
+    Map each transition on keypad to the transitions which the robot
+    operating keypad makes on the directional keypad to carry it out.
+    """
+    keys: List[str] = list(keypad.legalpositions.values())
+    retval: Dict[str, Dict[str, int]] = {}
+    for keyfrom in keys:
+        for keyto in keys:
+            if keyfrom == keyto:
+                retval[keyfrom + keyto] = line_transitions("A")
+            else:
+                retval[keyfrom + keyto] = line_transitions(
+                    keypad.movements[keyfrom + keyto]
                 )
     return retval
 
 
+def expand_transitions(
+    expansions: Dict[str, Dict[str, int]], transitions: Dict[str, int]
+) -> Dict[str, int]:
+    """
+    The return value counts the transitions of the expansion of a
+    string, whose own transitions are counted by transitions.
+    """
+    retval: Dict[str, int] = {}
+    for transition, count in transitions.items():
+        for subtransition, subcount in expansions[transition].items():
+            retval[subtransition] = retval.get(subtransition, 0) + count * subcount
+    return retval
+
+
+def count_sequence_length(
+    line: str,
+    numeric_expansions: Dict[str, Dict[str, int]],
+    chain_lengths: Dict[str, int],
+) -> int:
+    """
+    Length of the sequence typed by the human for line to be typed on
+    the numeric keypad.
+    numeric_expansions is prepare_transition_expansions() of the numeric
+    keypad, and chain_lengths is directional_lengths() through the
+    directional keypad robots. Both are computed once for all lines, so
+    the levels of the chain are expanded once rather than once per line.
+    """
+    transitions = expand_transitions(numeric_expansions, line_transitions(line))
+    return sum(
+        count * (1 if transition[0] == transition[1] else chain_lengths[transition])
+        for transition, count in transitions.items()
+    )
+
+
+def cheapest_sequence_length(keypad: Keypad, line: str, depth: int) -> int:
+    """
+    Length of the shortest sequence typed by the human for line to be
+    typed on keypad, when depth keypads separate the human from keypad.
+    Unlike the other engines, this relies on Keypad.cost() rather than
+    on Keypad.movements, so it is optimal for any keypad layouts.
+    """
+    return sum(
+        keypad.cost(pos_from, pos_to, depth)
+        for pos_from, pos_to in pairwise("A" + line)
+    )
+
+
+########################################################################
+# Transition matrix
+#
+# One level of pair-count expansion is a fixed linear map over the
+# transitions of the directional keypad. Write it as a matrix whose row
+# for each transition counts the transitions of its expansion. Then
+# the lengths, after depth levels, of the sequences carrying out each
+# transition are the matrix raised to the power depth, times a vector
+# of ones (a transition typed directly costs one keypress). Raising to
+# the power by repeated squaring takes only about 2*log2(depth) matrix
+# products.
+
+Matrix = List[List[int]]
+
+
+def prepare_transition_matrix(keypad: Keypad) -> Tuple[List[str], Matrix]:
+    """
+    The return value is the list of transitions on keypad, and the
+    matrix of one level of their expansion, indexed by that list.
+    """
+    expansions = prepare_transition_expansions(keypad)
+    transitions: List[str] = sorted(expansions.keys())
+    matrix: Matrix = [
+        [expansions[transition].get(subtransition, 0) for subtransition in transitions]
+        for transition in transitions
+    ]
+    return (transitions, matrix)
+
+
+def matrix_product(left: Matrix, right: Matrix) -> Matrix:
+    columns = list(zip(*right))
+    return [
+        [sum(lval * rval for lval, rval in zip(row, column)) for column in columns]
+        for row in left
+    ]
+
+
+def matrix_vector_product(matrix: Matrix, vector: List[int]) -> List[int]:
+    return [sum(mval * vval for mval, vval in zip(row, vector)) for row in matrix]
+
+
+def transition_lengths(keypad: Keypad, depth: int) -> Dict[str, int]:
+    """
+    The return value is Dict from each transition on keypad to the
+    length of the sequence carrying it out through depth levels of
+    keypad robots, as used by execute_10x_expansion().
+    """
+    (transitions, power) = prepare_transition_matrix(keypad)
+    lengths: List[int] = [1] * len(transitions)
+    while depth > 0:
+        if depth & 1:
+            lengths = matrix_vector_product(power, lengths)
+        depth >>= 1
+        if depth > 0:
+            power = matrix_product(power, power)
+    return dict(zip(transitions, lengths))
+
+
+########################################################################
+# Batch mode
+#
+# The codes share their transitions on the numeric keypad (there are
+# only 11*11 of them), and all of those share the directional levels.
+# So the directional transition lengths are computed once through the
+# whole chain, each distinct numeric transition is costed once from
+# them, and every code's length is split back out of its own
+# transition counts.
+
+
+def batch_sequence_lengths(codes: List[str], chain_length: int) -> Dict[str, int]:
+    """
+    The return value is Dict from each of codes to the length of the
+    sequence typed by the human for it, through chain_length
+    directional keypad robots.
+    """
+    code_transitions: Dict[str, Dict[str, int]] = {
+        code: line_transitions(code) for code in codes
+    }
+    numeric_transitions: Set[str] = set()
+    for transitions in code_transitions.values():
+        numeric_transitions.update(transitions.keys())
+
+    chain_lengths = directional_lengths(chain_length)
+    numeric_lengths: Dict[str, int] = {
+        transition: execute_10x_expansion(
+            movelengths=chain_lengths,
+            line=(
+                "A"
+                if transition[0] == transition[1]
+                else numeric_keypad().movements[transition]
+            ),
+        )
+        for transition in numeric_transitions
+    }
+    return {
+        code: sum(
+            count * numeric_lengths[transition]
+            for transition, count in transitions.items()
+        )
+        for code, transitions in code_transitions.items()
+    }
+
+
 ########################################################################
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -358,6 +846,33 @@ if __name__ == "__main__":
         dest="wormhole",
         help="Length of speedup wormhole. Default is %(default)d. 0 turns it off",
     )
+    parser.add_argument(
+        "--cache-file",
+        default=DEFAULT_CACHE_FILE,
+        dest="cache_file",
+        help="File keeping keypad movements and transition lengths between runs. Default is %(default)s. An empty string turns it off.",
+    )
+    parser.add_argument(
+        "-t",
+        "--trace",
+        default="",
+        dest="trace",
+        help="Comma-separated codes whose expansion by the strings engine is to be traced, transition by transition.",
+    )
+    parser.add_argument(
+        "--trace-levels",
+        default="",
+        dest="trace_levels",
+        help="Comma-separated levels to trace (1 is the numeric keypad expansion). Default is all levels.",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=["strings", "pairs", "matrix", "cost", "batch"],
+        default="strings",
+        dest="engine",
+        help="strings: expand the full keypress string at every level. pairs: count_sequence_length() expands only the counts of (from,to) transitions, so that the work per level does not grow with the strings. matrix: transition_lengths() raises the matrix of one such level to the power of the chain length, for very long chains. cost: cheapest_sequence_length() minimizes over all paths at every level using Keypad.cost(). batch: batch_sequence_lengths() reads all codes first and shares the work on their common transitions. --wormhole is used only by the strings engine. Default is %(default)s.",
+    )
     args = parser.parse_args()
 
     ROBOT_CHAIN_LENGTH: int = args.chain_length
@@ -376,58 +891,118 @@ if __name__ == "__main__":
     ########################################################################
     # Input data parsing
     ########################################################################
-    dict_10x_expansion: Dict[str, int] = prepare_10x_expansion_dict(
-        factor=TENx_EXPANSION_FACTOR, keypad=BOARD_DIRECTIONAL_KEYPAD
-    )
+    ENGINE: str = args.engine
+    TRACE_CODES: Set[str] = set(code for code in args.trace.split(",") if code)
+    TRACE_LEVELS: Optional[Set[int]] = None
+    if len(args.trace_levels) > 0:
+        TRACE_LEVELS = set(int(level) for level in args.trace_levels.split(","))
+    if len(args.cache_file) > 0:
+        TABLE_CACHE.filename = args.cache_file
+    if hasattr(sys, "set_int_max_str_digits"):
+        # Long robot chains yield lengths with more digits than Python
+        # agrees to print by default.
+        sys.set_int_max_str_digits(0)
+    if ENGINE == "strings":
+        dict_10x_expansion: Dict[str, int] = directional_lengths(TENx_EXPANSION_FACTOR)
+    elif ENGINE == "pairs":
+        numeric_expansions: Dict[str, Dict[str, int]] = prepare_transition_expansions(
+            numeric_keypad()
+        )
+        chain_lengths: Dict[str, int] = directional_lengths(ROBOT_CHAIN_LENGTH)
+    elif ENGINE == "matrix":
+        chain_lengths = transition_lengths(
+            keypad=directional_keypad(), depth=ROBOT_CHAIN_LENGTH
+        )
 
     complexities = 0
 
-    for line in sys.stdin:
+    input_lines: Iterable[str] = sys.stdin
+    if ENGINE == "batch":
+        codes: List[str] = [line.strip() for line in sys.stdin]
+        batch_lengths: Dict[str, int] = batch_sequence_lengths(
+            codes=[code for code in codes if len(code) > 0],
+            chain_length=ROBOT_CHAIN_LENGTH,
+        )
+        input_lines = codes
+
+    for line in input_lines:
         sline = line.strip()
         if len(sline) == 0:
             # Ignore empty lines, no special processing is needed.
             continue
 
-        # To perform expansion of a line:
-        # Replace each character in the original line by a string
-        # from a keypad.movements.
-        kp1: str = expand_line_by_keypad(keypad=BOARD_NUMERIC_KEYPAD, line=sline)
-        kp1_min = len(kp1)
-        sys.stdout.write(f"For {sline=}, expansion 1 length:{kp1_min}\n")
-
-        sys.stdout.write(
-            f"config: Will perform {ROBOT_CHAIN_LENGTH}+1 iterations\nconfig: (typically, 2+1 iterations for part 1, 25+1 iterations for part 2)\n"
-        )
-        sys.stdout.write(f"config: TENx expansion factor is {TENx_EXPANSION_FACTOR}\n")
-        kp_prev = kp1
-        loopind = 2
         kp_curr_min: int = 0  # Will serve as total sequence length.
-        while loopind < ROBOT_CHAIN_LENGTH + 2:
-            if loopind == (ROBOT_CHAIN_LENGTH + 2 - TENx_EXPANSION_FACTOR):
-                # Jump TENx_EXPANSION_FACTOR (typically 10) expansions
-                # then break.
-                #
-                # Note: if total robot chain length is shorter
-                # than TENx_EXPANSION_FACTOR, we do not bother to
-                # invoke the speedup.
-                kp_curr_min = execute_10x_expansion(
-                    movelengths=dict_10x_expansion, line=kp_prev
-                )
-                sys.stdout.write(
-                    f"For {sline=}, expansion {loopind}->{loopind+TENx_EXPANSION_FACTOR} length:{kp_curr_min}\n"
-                )
-                break
-            kp_curr: str = expand_line_by_keypad(
-                keypad=BOARD_DIRECTIONAL_KEYPAD, line=kp_prev
+        if ENGINE == "batch":
+            kp_curr_min = batch_lengths[sline]
+        elif ENGINE == "pairs":
+            kp_curr_min = count_sequence_length(
+                line=sline,
+                numeric_expansions=numeric_expansions,
+                chain_lengths=chain_lengths,
+            )
+        elif ENGINE == "cost":
+            # Also the robot operating the numeric keypad uses a
+            # directional keypad.
+            kp_curr_min = cheapest_sequence_length(
+                keypad=numeric_keypad(),
+                line=sline,
+                depth=ROBOT_CHAIN_LENGTH + 1,
+            )
+        elif ENGINE == "matrix":
+            kp_curr_min = execute_10x_expansion(
+                movelengths=chain_lengths,
+                line=expand_line_by_keypad(keypad=numeric_keypad(), line=sline),
+            )
+        else:
+            # To perform expansion of a line:
+            # Replace each character in the original line by a string
+            # from a keypad.movements.
+            kp1: str = expand_line_by_keypad(
+                keypad=numeric_keypad(),
+                line=sline,
+                trace=select_tracer(TRACE_CODES, TRACE_LEVELS, sline, 1),
+            )
+            kp1_min = len(kp1)
+            sys.stdout.write(f"For {sline=}, expansion 1 length:{kp1_min}\n")
+
+            sys.stdout.write(
+                f"config: Will perform {ROBOT_CHAIN_LENGTH}+1 iterations\nconfig: (typically, 2+1 iterations for part 1, 25+1 iterations for part 2)\n"
             )
-            kp_curr_min = len(kp_curr)
             sys.stdout.write(
-                f"For {sline=}, expansion {loopind} length:{kp_curr_min}\n"
+                f"config: TENx expansion factor is {TENx_EXPANSION_FACTOR}\n"
             )
-            if DEBUG5:
-                sys.stdout.write(f"***** {kp_curr[:1000]} *****\n")
-            kp_prev = kp_curr
-            loopind += 1
+            kp_prev = kp1
+            loopind = 2
+            while loopind < ROBOT_CHAIN_LENGTH + 2:
+                if loopind == (ROBOT_CHAIN_LENGTH + 2 - TENx_EXPANSION_FACTOR):
+                    # Jump TENx_EXPANSION_FACTOR (typically 10) expansions
+                    # then break.
+                    #
+                    # Note: if total robot chain length is shorter
+                    # than TENx_EXPANSION_FACTOR, we do not bother to
+                    # invoke the speedup.
+                    kp_curr_min = execute_10x_expansion(
+                        movelengths=dict_10x_expansion,
+                        line=kp_prev,
+                        trace=select_tracer(TRACE_CODES, TRACE_LEVELS, sline, loopind),
+                    )
+                    sys.stdout.write(
+                        f"For {sline=}, expansion {loopind}->{loopind+TENx_EXPANSION_FACTOR} length:{kp_curr_min}\n"
+                    )
+                    break
+                kp_curr: str = expand_line_by_keypad(
+                    keypad=directional_keypad(),
+                    line=kp_prev,
+                    trace=select_tracer(TRACE_CODES, TRACE_LEVELS, sline, loopind),
+                )
+                kp_curr_min = len(kp_curr)
+                sys.stdout.write(
+                    f"For {sline=}, expansion {loopind} length:{kp_curr_min}\n"
+                )
+                if DEBUG5:
+                    sys.stdout.write(f"***** {kp_curr[:1000]} *****\n")
+                kp_prev = kp_curr
+                loopind += 1
 
         complexity: int = kp_curr_min * int(sline[:-1])
         sys.stdout.write(
@@ -439,6 +1014,7 @@ if __name__ == "__main__":
     ########################################################################
     # Write out answer
     ########################################################################
+    TABLE_CACHE.save()
     answer = complexities
     sys.stdout.write(f"\n\nANSWER ---> {answer=}\n")
 